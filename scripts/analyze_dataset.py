@@ -3,6 +3,10 @@
 # analyze_dataset.py
 from datasets import load_dataset
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import os
 
 # Load HH-RLHF dataset
 print("Loading dataset...")
@@ -16,34 +20,62 @@ print(dataset)
 print("\nFirst example:")
 print(dataset['train'][0])
 
-# Convert to pandas for easier analysis
-train_df = pd.DataFrame(dataset['train'])
-test_df = pd.DataFrame(dataset['test'])
+# Work on the Arrow table backing the dataset instead of copying the long
+# conversation strings into pandas; only derived columns go into train_df
+train_table = dataset['train'].with_format('arrow')[:]
 
-print(f"\nTraining examples: {len(train_df)}")
-print(f"Test examples: {len(test_df)}")
+print(f"\nTraining examples: {train_table.num_rows}")
+print(f"Test examples: {len(dataset['test'])}")
 
-# Look at length distributions
-train_df['chosen_length'] = train_df['chosen'].str.len()
-train_df['rejected_length'] = train_df['rejected'].str.len()
+# Derived columns are cached to Parquet, so repeat runs skip the pass over
+# the full conversations
+ENRICHED_CACHE = 'hh_enriched.parquet'
+ENRICHED_COLUMNS = ['chosen_length', 'rejected_length', 'first_query']
+FIRST_QUERY_PATTERN = r'(?s)Human: (?P<query>.*?)(?:Assistant:|Human:|$)'
+# Bump this if the way the derived columns are computed changes
+ENRICHED_VERSION = 1
 
-# Basic statistics
-print("\nLength statistics:")
-print(train_df[['chosen_length', 'rejected_length']].describe())
+# The cache is only reused if it was built from this exact dataset version
+# with the same extraction, recorded in the Parquet file's metadata
+enriched_key = f"{dataset['train']._fingerprint}|{FIRST_QUERY_PATTERN}|{ENRICHED_VERSION}".encode()
 
-import re
-from collections import Counter
+train_df = None
+if os.path.exists(ENRICHED_CACHE):
+    cached_key = (pq.read_schema(ENRICHED_CACHE).metadata or {}).get(b'enriched_key')
+    if cached_key != enriched_key:
+        print(f"\n{ENRICHED_CACHE} was built from a different dataset or extraction, recomputing")
+    else:
+        # Only read the derived columns; dtype_backend keeps the strings Arrow-backed
+        train_df = pd.read_parquet(ENRICHED_CACHE, columns=ENRICHED_COLUMNS, dtype_backend='pyarrow')
+        print(f"\nLoaded derived columns from {ENRICHED_CACHE}")
 
-def extract_first_human_message(conversation):
-    """Extract the first thing the human says"""
-    # Split by Human: and Assistant:
-    match = re.search(r'Human: (.*?)(?:Assistant:|Human:|$)', conversation, re.DOTALL)
-    if match:
-        return match.group(1).strip()
-    return ""
+if train_df is None:
+    # Look at length distributions
+    train_df = pd.DataFrame({
+        'chosen_length': pc.utf8_length(train_table['chosen']).to_numpy(),
+        'rejected_length': pc.utf8_length(train_table['rejected']).to_numpy(),
+    })
+    
+    # Extract all initial queries (the first thing the human says) with Arrow
+    # compute kernels, so each conversation is visited once in C++
+    first_query = pc.utf8_trim_whitespace(
+        pc.struct_field(
+            pc.extract_regex(train_table['chosen'], pattern=FIRST_QUERY_PATTERN),
+            'query'
+        )
+    ).fill_null('')
+    # Keep the queries Arrow-backed so pandas .str methods dispatch to Arrow kernels
+    train_df['first_query'] = first_query.to_pandas(types_mapper=pd.ArrowDtype)
+    
+    enriched_table = pa.Table.from_pandas(train_df, preserve_index=False)
+    enriched_table = enriched_table.replace_schema_metadata(
+        {**(enriched_table.schema.metadata or {}), b'enriched_key': enriched_key}
+    )
+    pq.write_table(enriched_table, ENRICHED_CACHE, compression='zstd')
 
-# Extract all initial queries
-train_df['first_query'] = train_df['chosen'].apply(extract_first_human_message)
+# Basic statistics
+print("\nLength statistics:")
+print(train_df[['chosen_length', 'rejected_length']].describe())
 
 # Sample some queries to understand domains
 print("Sample queries:")
@@ -65,32 +97,54 @@ topic_keywords = {
 
 }
 
-def categorize_query(query):
-    """Simple keyword-based categorization"""
-    query_lower = query.lower()
-    categories = []
-    for topic, keywords in topic_keywords.items():
-        if any(kw in query_lower for kw in keywords):
-            categories.append(topic)
-    return categories if categories else ['other']
+import re
 
-train_df['categories'] = train_df['first_query'].apply(categorize_query)
+# One alternation per category, so each query is scanned once per category
+# rather than once per keyword
+CATEGORY_PATTERNS = {
+    topic: '|'.join(map(re.escape, keywords))
+    for topic, keywords in topic_keywords.items()
+}
+
+# Build one boolean column per category: a query belongs to a category if
+# it contains any of its keywords. Each column is a single vectorized
+# str.contains instead of a Python list of categories per row.
+query_lower = train_df['first_query'].str.lower()
+category_masks = pd.DataFrame({
+    topic: query_lower.str.contains(pattern, regex=True).to_numpy(dtype=bool)
+    for topic, pattern in CATEGORY_PATTERNS.items()
+}, index=train_df.index)
+category_masks['other'] = ~category_masks.any(axis=1)
 
-# Flatten and count
-from itertools import chain
-all_categories = list(chain.from_iterable(train_df['categories']))
-category_counts = Counter(all_categories)
+category_counts = category_masks.sum()
+category_counts = category_counts[category_counts > 0].sort_values(ascending=False)
 
 print("Category distribution:")
-for cat, count in category_counts.most_common():
-    print(f"{cat}: {count} ({count/len(train_df)*100:.1f}%)")
+percent_per_row = 100.0 / len(train_df)
+for cat, count in category_counts.items():
+    print(f"{cat}: {count} ({count*percent_per_row:.1f}%)")
 
 # Manually review a sample to identify failure modes
 import random
 random.seed(42)
 
-def review_sample(df, n=50, category_filter='fitness'):
-    """Helper to review random samples"""
+# Failure mode codes used when reviewing, interactively or in a CSV batch
+FAILURE_MODE_CODES = {
+    '1': 'too_short',
+    '2': 'too_verbose',
+    '3': 'unhelpful',
+    '4': 'inconsistent',
+    '5': 'unclear_preference',
+    '6': 'factual_errors'
+}
+
+def sample_for_review(df, category_masks, table, n=50, category_filter='fitness'):
+    """
+    Pick random examples to review, optionally limited to some categories
+
+    Returns:
+        (sample_indices, records, record_categories), or None if nothing matches
+    """
 
 # Filter by category if specified
     if category_filter is not None:
@@ -98,16 +152,14 @@ def review_sample(df, n=50, category_filter='fitness'):
             category_filter = [category_filter]
         
         # Filter rows where ANY of the specified categories appear
-        filtered_df = df[df['categories'].apply(
-            lambda cats: any(cat in category_filter for cat in cats)
-        )]
+        filtered_df = df[category_masks[category_filter].any(axis=1)]
         
         print(f"Filtered to {len(filtered_df)} examples with categories: {category_filter}")
         print(f"Original dataset had {len(df)} examples")
         
         if len(filtered_df) == 0:
             print("No examples found with specified categories!")
-            return {}
+            return None
     else:
         filtered_df = df
     
@@ -117,23 +169,36 @@ def review_sample(df, n=50, category_filter='fitness'):
         sample_indices = list(range(len(filtered_df)))
     else:
         sample_indices = random.sample(range(len(filtered_df)), n)
+    
+    # Pull the sampled rows out once as plain records, rather than building
+    # a pandas row for every step of the interactive loop
+    positions = filtered_df.index[sample_indices].to_numpy()
+    records = table.select(['chosen', 'rejected']).take(positions).to_pylist()
+    topics = category_masks.columns
+    record_categories = [
+        [topic for topic, hit in zip(topics, row_masks) if hit]
+        for row_masks in category_masks.loc[positions].to_numpy()
+    ]
+    for record, position in zip(records, positions):
+        record['row'] = int(position)
+    
+    return sample_indices, records, record_categories
+
+def review_sample(df, category_masks, table, n=50, category_filter='fitness'):
+    """Helper to review random samples"""
+    sample = sample_for_review(df, category_masks, table, n=n, category_filter=category_filter)
+    if sample is None:
+        return {}
+    sample_indices, records, record_categories = sample
 
-    failure_modes = {
-        'too_short': [],
-        'too_verbose': [],
-        'unhelpful': [],
-        'inconsistent': [],
-        'unclear_preference': [],
-        'factual_errors': []
-    }
+    failure_modes = {mode: [] for mode in FAILURE_MODE_CODES.values()}
     
-    for idx in sample_indices:
-        row = filtered_df.iloc[idx]
+    for idx, row, row_categories in zip(sample_indices, records, record_categories):
         print(f"\n{'='*80}")
         print(f"Example {idx}")
         print(f"\nCHOSEN:\n{row['chosen'][:500]}...")
         print(f"\nREJECTED:\n{row['rejected'][:500]}...")
-        print(f"\nCategories: {row['categories']}")
+        print(f"\nCategories: {row_categories}")
         
         # Manual input
         print("\nFailure modes (if any)? Enter comma-separated:")
@@ -144,5 +209,49 @@ def review_sample(df, n=50, category_filter='fitness'):
     
     return failure_modes
 
-# You would run this and take notes
-failure_analysis = review_sample(train_df, n=50, category_filter='fitness')
+def export_review_batch(df, category_masks, table, filename='review_batch.csv', n=50, category_filter='fitness'):
+    """
+    Write a review sample to CSV with an empty failure_modes column, so it can
+    be labeled in a spreadsheet (or by several annotators) instead of
+    answering input() prompts one example at a time
+    """
+    sample = sample_for_review(df, category_masks, table, n=n, category_filter=category_filter)
+    if sample is None:
+        return None
+    sample_indices, records, record_categories = sample
+    
+    batch = pd.DataFrame(records, index=pd.Index(sample_indices, name='example'))
+    batch['categories'] = [', '.join(cats) for cats in record_categories]
+    batch['failure_modes'] = ''
+    batch.to_csv(filename)
+    
+    print(f"\nWrote {len(batch)} examples to {filename}")
+    print("Fill in failure_modes with comma-separated codes:")
+    print("1=too_short, 2=too_verbose, 3=unhelpful, 4=inconsistent, 5=unclear, 6=factual_error, 0=none")
+    return filename
+
+def load_review_batch(filename='review_batch.csv'):
+    """Read a labeled review batch back into the same dict review_sample returns"""
+    batch = pd.read_csv(filename, index_col='example', dtype={'failure_modes': str})
+    labels = batch['failure_modes'].fillna('').str.replace(' ', '')
+    
+    failure_modes = {mode: [] for mode in FAILURE_MODE_CODES.values()}
+    for idx, codes in labels.items():
+        for code in codes.split(','):
+            if code in FAILURE_MODE_CODES:
+                failure_modes[FAILURE_MODE_CODES[code]].append(idx)
+    
+    print(f"\nLoaded {labels.ne('').sum()}/{len(batch)} labeled examples from {filename}")
+    for mode, examples in failure_modes.items():
+        print(f"  {mode}: {len(examples)}")
+    return failure_modes
+
+# You would run this and take notes, or label a CSV batch outside the script
+review_mode = input("\nReview here (i) or export a CSV batch to label (c)? ").lower().strip()
+if review_mode == 'c':
+    review_file = export_review_batch(train_df, category_masks, train_table, n=50, category_filter='fitness')
+    if review_file:
+        input(f"\nLabel {review_file}, then press Enter to load it back...")
+        failure_analysis = load_review_batch(review_file)
+else:
+    failure_analysis = review_sample(train_df, category_masks, train_table, n=50, category_filter='fitness')
@@ -1,12 +1,28 @@
 # format_dataset.py
-import json
-from sklearn.model_selection import train_test_split
+import gzip
+import math
+from collections import Counter
+import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+import numpy as np
 import os
+from label_records import join_labels, load_jsonl
 
-def load_labeled_data(filename='fitness_response_pairs_labeled.json'):
-    """Load the labeled preference data"""
-    with open(filename, 'r') as f:
-        data = json.load(f)
+def load_labeled_data(filename='fitness_response_pairs_labeled.jsonl',
+                      pairs_file='fitness_response_pairs.jsonl'):
+    """
+    Load the labeled preference data, joining each label onto its response pair
+    
+    Args:
+        filename: Labels from the labeling tool (one JSON object per line)
+        pairs_file: The response pairs the labels were made against
+    """
+    labels = load_jsonl(filename)
+    # Labels only hold the decision and which pair it was for
+    pairs = load_jsonl(pairs_file) if any('prompt' not in label for label in labels) else []
+    data = join_labels(labels, pairs)
+    
     print(f"Loaded {len(data)} labeled examples")
     return data
 
@@ -17,13 +33,16 @@ def analyze_labels(data):
     print("="*80)
     
     total = len(data)
-    preferences = [item.get('preference', 'unknown') for item in data]
+    # Count all preferences in one pass
+    preference_counts = Counter(item.get('preference', 'unknown') for item in data)
+    a_wins = preference_counts['a']
+    b_wins = preference_counts['b']
     equal_count = sum(1 for item in data if item.get('equal', False))
     
     print(f"\nTotal examples: {total}")
     print(f"\nPreference distribution:")
-    print(f"  Response A preferred: {preferences.count('a')} ({preferences.count('a')/total*100:.1f}%)")
-    print(f"  Response B preferred: {preferences.count('b')} ({preferences.count('b')/total*100:.1f}%)")
+    print(f"  Response A preferred: {a_wins} ({a_wins/total*100:.1f}%)")
+    print(f"  Response B preferred: {b_wins} ({b_wins/total*100:.1f}%)")
     print(f"  Equal quality: {equal_count} ({equal_count/total*100:.1f}%)")
     
     # Check for reasoning
@@ -33,8 +52,6 @@ def analyze_labels(data):
     # Temperature analysis
     temp_a = data[0]['metadata']['temp_a']
     temp_b = data[0]['metadata']['temp_b']
-    a_wins = preferences.count('a')
-    b_wins = preferences.count('b')
     
     if a_wins + b_wins > 0:
         print(f"\nTemperature preference:")
@@ -93,20 +110,18 @@ def create_splits(data, test_size=0.1, val_size=0.1, random_seed=42):
         random_seed: Random seed for reproducibility
     """
     
-    # First split: separate test set
-    train_val, test = train_test_split(
-        data, 
-        test_size=test_size, 
-        random_state=random_seed
-    )
-    
-    # Second split: separate validation from training
+    # Shuffle indices once and slice them into test / validation / train.
+    # Sizes use the same float expressions as the old two-step
+    # train_test_split: ceil(test_size * n), then ceil(val_proportion * rest)
+    rng = np.random.default_rng(random_seed)
+    perm = rng.permutation(len(data))
+    n_test = math.ceil(test_size * len(data))
     val_proportion = val_size / (1 - test_size)
-    train, val = train_test_split(
-        train_val, 
-        test_size=val_proportion, 
-        random_state=random_seed
-    )
+    n_val = math.ceil(val_proportion * (len(data) - n_test))
+    
+    test = [data[i] for i in perm[:n_test]]
+    val = [data[i] for i in perm[n_test:n_test + n_val]]
+    train = [data[i] for i in perm[n_test + n_val:]]
     
     splits = {
         'train': train,
@@ -124,40 +139,39 @@ def create_splits(data, test_size=0.1, val_size=0.1, random_seed=42):
     
     return splits
 
-def save_splits(splits, output_dir='fitness_dataset'):
-    """Save splits as JSONL files"""
+def save_splits(splits, output_dir='fitness_dataset', pretty=False):
+    """
+    Save splits as gzip-compressed JSONL files (datasets reads .jsonl.gz directly)
+    
+    Args:
+        splits: Dict of split name -> list of examples
+        output_dir: Directory to write the files to
+        pretty: Also write an indented .json copy of each split for easier viewing
+    """
     
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
     
     for split_name, split_data in splits.items():
-        output_file = os.path.join(output_dir, f'{split_name}.jsonl')
+        output_file = os.path.join(output_dir, f'{split_name}.jsonl.gz')
         
-        with open(output_file, 'w') as f:
+        with gzip.open(output_file, 'wb') as f:
             for item in split_data:
-                f.write(json.dumps(item) + '\n')
+                f.write(orjson.dumps(item))
+                f.write(b'\n')
         
         print(f"Saved {split_name}: {output_file}")
-    
-    # Also save as regular JSON for easier viewing
-    for split_name, split_data in splits.items():
-        output_file = os.path.join(output_dir, f'{split_name}.json')
-        with open(output_file, 'w') as f:
-            json.dump(split_data, f, indent=2)
+        
+        if pretty:
+            pretty_file = os.path.join(output_dir, f'{split_name}.json')
+            with open(pretty_file, 'wb') as f:
+                f.write(orjson.dumps(split_data, option=orjson.OPT_INDENT_2))
     
     print(f"\nAll files saved to: {output_dir}/")
     return output_dir
 
-def create_dataset_card(splits, output_dir='fitness_dataset'):
-    """Create a comprehensive dataset card (README.md)"""
-    
-    total_examples = sum(len(split) for split in splits.values())
-    
-    # Calculate preference statistics from training set
-    train_data = splits['train']
-    preferences = [item['metadata']['preference'] for item in train_data]
-    
-    dataset_card = f"""---
+# Dataset card template, filled in with str.format_map by create_dataset_card
+DATASET_CARD_TEMPLATE = """---
 license: mit
 task_categories:
 - text-generation
@@ -234,9 +248,9 @@ Each example contains a fitness question with two responses, where one response
 
 | Split | Examples | Percentage |
 |-------|----------|------------|
-| Train | {len(splits['train'])} | {len(splits['train'])/total_examples*100:.1f}% |
-| Validation | {len(splits['validation'])} | {len(splits['validation'])/total_examples*100:.1f}% |
-| Test | {len(splits['test'])} | {len(splits['test'])/total_examples*100:.1f}% |
+| Train | {train_count} | {train_pct:.1f}% |
+| Validation | {validation_count} | {validation_pct:.1f}% |
+| Test | {test_count} | {test_pct:.1f}% |
 | **Total** | **{total_examples}** | **100%** |
 
 ## Dataset Creation
@@ -280,14 +294,14 @@ Preferences were labeled by a fitness-knowledgeable annotator following these cr
 #### Quality Control
 
 - Consistent rubric applied across all examples
-- {sum(1 for item in train_data if item['metadata'].get('reasoning', '').strip())} examples ({sum(1 for item in train_data if item['metadata'].get('reasoning', '').strip())/len(train_data)*100:.1f}%) include detailed reasoning
+- {reasoning_count} examples ({reasoning_pct:.1f}%) include detailed reasoning
 - Regular review of labeled examples for consistency
 
 #### Preference Distribution
 
 In the training set:
-- Response A preferred: {preferences.count('a')} ({preferences.count('a')/len(preferences)*100:.1f}%)
-- Response B preferred: {preferences.count('b')} ({preferences.count('b')/len(preferences)*100:.1f}%)
+- Response A preferred: {a_count} ({a_pct:.1f}%)
+- Response B preferred: {b_count} ({b_pct:.1f}%)
 
 ### Personal and Sensitive Information
 
@@ -386,14 +400,52 @@ print(train_data[0])
 ### Response Length Distribution
 
 Average lengths in training set:
-- Chosen responses: {sum(len(item['chosen']) for item in train_data)/len(train_data):.0f} characters
-- Rejected responses: {sum(len(item['rejected']) for item in train_data)/len(train_data):.0f} characters
+- Chosen responses: {avg_chosen_length:.0f} characters
+- Rejected responses: {avg_rejected_length:.0f} characters
 
 ### Prompt Diversity
 
 The dataset covers various fitness topics including strength training, Peloton, cardio, nutrition, recovery, and form guidance across different skill levels.
 """
 
+def create_dataset_card(splits, output_dir='fitness_dataset'):
+    """Create a comprehensive dataset card (README.md)"""
+    
+    total_examples = sum(len(split) for split in splits.values())
+    
+    # Calculate preference statistics from training set
+    train_data = splits['train']
+    preference_counts = Counter(item['metadata']['preference'] for item in train_data)
+    a_count = preference_counts['a']
+    b_count = preference_counts['b']
+    reasoning_count = sum(1 for item in train_data if item['metadata'].get('reasoning', '').strip())
+    
+    # Average response lengths, computed by Arrow kernels over each column's string buffer
+    chosen_arr = pa.array([item['chosen'] for item in train_data], type=pa.string())
+    rejected_arr = pa.array([item['rejected'] for item in train_data], type=pa.string())
+    avg_chosen_length = pc.mean(pc.utf8_length(chosen_arr)).as_py()
+    avg_rejected_length = pc.mean(pc.utf8_length(rejected_arr)).as_py()
+    
+    # Every statistic is computed once here; the template is a constant string
+    stats = {
+        'total_examples': total_examples,
+        'train_count': len(splits['train']),
+        'train_pct': len(splits['train'])/total_examples*100,
+        'validation_count': len(splits['validation']),
+        'validation_pct': len(splits['validation'])/total_examples*100,
+        'test_count': len(splits['test']),
+        'test_pct': len(splits['test'])/total_examples*100,
+        'reasoning_count': reasoning_count,
+        'reasoning_pct': reasoning_count/len(train_data)*100,
+        'a_count': a_count,
+        'a_pct': a_count/len(train_data)*100,
+        'b_count': b_count,
+        'b_pct': b_count/len(train_data)*100,
+        'avg_chosen_length': avg_chosen_length,
+        'avg_rejected_length': avg_rejected_length,
+    }
+    dataset_card = DATASET_CARD_TEMPLATE.format_map(stats)
+
     # Save the dataset card
     readme_path = os.path.join(output_dir, 'README.md')
     with open(readme_path, 'w') as f:
@@ -428,7 +480,7 @@ if __name__ == "__main__":
     print("="*80)
     
     # Step 1: Load labeled data
-    labeled_data = load_labeled_data('fitness_response_pairs_labeled.json')
+    labeled_data = load_labeled_data('fitness_response_pairs_labeled.jsonl', 'fitness_response_pairs.jsonl')
     
     # Step 2: Analyze the labels
     analyze_labels(labeled_data)
@@ -447,7 +499,8 @@ if __name__ == "__main__":
     splits = create_splits(formatted_data, test_size=0.1, val_size=0.1, random_seed=42)
     
     # Step 5: Save splits
-    output_dir = save_splits(splits, output_dir='fitness_dataset')
+    pretty = input("\nAlso save pretty-printed .json copies for viewing? (y/n): ").lower() == 'y'
+    output_dir = save_splits(splits, output_dir='fitness_dataset', pretty=pretty)
     
     # Step 6: Create dataset card
     create_dataset_card(splits, output_dir=output_dir)
@@ -460,8 +513,7 @@ if __name__ == "__main__":
     print("="*80)
     print(f"\nYour dataset is ready in the '{output_dir}/' directory")
     print("\nFiles created:")
-    print(f"  - train.jsonl / train.json")
-    print(f"  - validation.jsonl / validation.json")
-    print(f"  - test.jsonl / test.json")
+    for split_name in splits:
+        print(f"  - {split_name}.jsonl.gz" + (f" / {split_name}.json" if pretty else ""))
     print(f"  - README.md (dataset card)")
     print("\nNext step: Upload to Hugging Face!")
\ No newline at end of file
@@ -1,27 +1,27 @@
 # generate_prompts.py
 import anthropic
-import json
-import time
+import asyncio
+import csv
+import orjson
 import os
 
 # Initialize the Anthropic client
-client = anthropic.Anthropic(
-     api_key=os.environ.get("ANTHROPIC_API_KEY")
+# The SDK already retries rate limits (429) and server errors with
+# exponential backoff, so batches don't need a fixed pause between them
+client = anthropic.AsyncAnthropic(
+     api_key=os.environ.get("ANTHROPIC_API_KEY"),
+     max_retries=5
 )
 
-def generate_fitness_prompts(num_prompts=100, batch_size=20):
+async def generate_batch(batch_num, batch_size, semaphore):
     """
-    Generate diverse fitness-related prompts using Claude
-    
-    Args:
-        num_prompts: Total number of prompts to generate
-        batch_size: How many prompts to generate per API call
+    Generate one batch of fitness prompts
+
+    Returns:
+        List of prompt strings (empty if the batch failed)
     """
-    all_prompts = []
-    num_batches = (num_prompts + batch_size - 1) // batch_size  # Ceiling division
-    
-    for batch_num in range(num_batches):
-        print(f"\nGenerating batch {batch_num + 1}/{num_batches}...")
+    async with semaphore:
+        print(f"\nGenerating batch {batch_num + 1}...")
         
         # Create the prompt for Claude
         system_prompt = """You are an expert at creating diverse fitness and exercise questions 
@@ -57,7 +57,7 @@ Example format:
 
         try:
             # Call Claude API
-            message = client.messages.create(
+            message = await client.messages.create(
                 model="claude-sonnet-4-20250514",
                 max_tokens=2000,
                 temperature=0.8,  # Higher temperature for more diversity
@@ -82,52 +82,117 @@ Example format:
             response_text = response_text.strip()
             
             # Parse JSON
-            batch_prompts = json.loads(response_text)
+            batch_prompts = orjson.loads(response_text)
             
             # Validate we got a list
             if not isinstance(batch_prompts, list):
                 print(f"Warning: Expected list but got {type(batch_prompts)}")
-                continue
+                return []
                 
-            print(f"Generated {len(batch_prompts)} prompts in this batch")
-            
-            # Add to our collection
-            all_prompts.extend(batch_prompts)
+            print(f"Generated {len(batch_prompts)} prompts in batch {batch_num + 1}")
             
             # Show a sample
             if batch_prompts:
                 print(f"Sample: {batch_prompts[0]}")
             
-            # Rate limiting: pause between requests
-            time.sleep(1)
+            return batch_prompts
             
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             print(f"Error parsing JSON response: {e}")
             print(f"Response was: {response_text[:200]}...")
-            continue
+            return []
         except Exception as e:
             print(f"Error in API call: {e}")
-            continue
+            return []
+
+async def generate_all_batches(num_prompts, num_batches, batch_size, max_concurrent, max_batches):
+    """
+    Run batches concurrently, at most max_concurrent in flight
+
+    Prompts are deduplicated as each batch comes back, and batches that
+    haven't finished are cancelled once num_prompts unique prompts are in hand.
+    If duplicates or failed batches leave us short after the first
+    num_batches, extra batches are requested for what's missing, up to
+    max_batches in total.
+
+    Returns:
+        (unique_prompts, total number of prompts generated, batches started)
+    """
+    semaphore = asyncio.Semaphore(max_concurrent)
     
     # Remove duplicates while preserving order
     seen = set()
     unique_prompts = []
-    for prompt in all_prompts:
-        if prompt not in seen:
-            seen.add(prompt)
-            unique_prompts.append(prompt)
+    total_generated = 0
+    batches_started = 0
+    
+    while len(unique_prompts) < num_prompts and batches_started < max_batches:
+        if batches_started == 0:
+            round_size = num_batches
+        else:
+            missing = num_prompts - len(unique_prompts)
+            round_size = (missing + batch_size - 1) // batch_size
+            print(f"\nShort {missing} unique prompts, requesting {round_size} more batch(es)...")
+        round_size = min(round_size, max_batches - batches_started)
+        
+        tasks = [
+            asyncio.create_task(generate_batch(batch_num, batch_size, semaphore))
+            for batch_num in range(batches_started, batches_started + round_size)
+        ]
+        batches_started += round_size
+        
+        try:
+            for next_batch in asyncio.as_completed(tasks):
+                batch_prompts = await next_batch
+                total_generated += len(batch_prompts)
+                for prompt in batch_prompts:
+                    if prompt not in seen:
+                        seen.add(prompt)
+                        unique_prompts.append(prompt)
+                
+                if len(unique_prompts) >= num_prompts:
+                    break
+        finally:
+            # Skip any batches we no longer need
+            for task in tasks:
+                task.cancel()
+    
+    return unique_prompts, total_generated, batches_started
+
+def generate_fitness_prompts(num_prompts=100, batch_size=20, max_concurrent=5, max_batches=None):
+    """
+    Generate diverse fitness-related prompts using Claude
+    
+    Args:
+        num_prompts: Total number of prompts to generate
+        batch_size: How many prompts to generate per API call
+        max_concurrent: How many API calls to have in flight at once
+        max_batches: Cap on API calls when topping up after duplicates
+            or failures (None = twice the planned number of batches)
+    """
+    num_batches = (num_prompts + batch_size - 1) // batch_size  # Ceiling division
+    if max_batches is None:
+        max_batches = 2 * num_batches
+    
+    unique_prompts, total_generated, batches_started = asyncio.run(
+        generate_all_batches(num_prompts, num_batches, batch_size, max_concurrent, max_batches)
+    )
     
     print(f"\n{'='*80}")
-    print(f"Total prompts generated: {len(all_prompts)}")
+    print(f"Batches requested: {batches_started}")
+    print(f"Total prompts generated: {total_generated}")
     print(f"Unique prompts: {len(unique_prompts)}")
-    print(f"Duplicates removed: {len(all_prompts) - len(unique_prompts)}")
+    print(f"Duplicates removed: {total_generated - len(unique_prompts)}")
+    if len(unique_prompts) < num_prompts:
+        print(f"Warning: only {len(unique_prompts)}/{num_prompts} unique prompts after {max_batches} batches")
     
     return unique_prompts
 
-def save_prompts(prompts, filename='fitness_prompts.json'):
-    """Save prompts to a JSON file"""
-    with open(filename, 'w') as f:
-        json.dump(prompts, f, indent=2)
+def save_prompts(prompts, filename='fitness_prompts.jsonl'):
+    """Save prompts to a JSONL file, one {"prompt": ...} object per line"""
+    with open(filename, 'wb') as f:
+        for prompt in prompts:
+            f.write(orjson.dumps({'prompt': prompt}, option=orjson.OPT_APPEND_NEWLINE))
     print(f"\nPrompts saved to {filename}")
 
 def review_and_filter_prompts(prompts):
@@ -163,6 +228,29 @@ def review_and_filter_prompts(prompts):
     print(f"Final count: {len(kept_prompts)} prompts kept out of {len(prompts)}")
     return kept_prompts
 
+def export_prompts_for_review(prompts, filename='fitness_prompts_review.csv'):
+    """
+    Write prompts to a CSV with a pre-filled 'keep' column, so they can be
+    filtered in a spreadsheet instead of one input() prompt at a time
+    """
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['keep', 'prompt'])
+        writer.writerows(('y', prompt) for prompt in prompts)
+    print(f"\nPrompts for review saved to {filename}")
+    print("Set 'keep' to 'n' for any prompt you want to remove")
+    return filename
+
+def load_reviewed_prompts(filename='fitness_prompts_review.csv'):
+    """Read a reviewed CSV back; anything not marked 'n' is kept"""
+    with open(filename, newline='') as f:
+        rows = list(csv.DictReader(f))
+    kept_prompts = [row['prompt'] for row in rows if row['keep'].lower().strip() != 'n']
+    
+    print(f"\n{'='*80}")
+    print(f"Final count: {len(kept_prompts)} prompts kept out of {len(rows)}")
+    return kept_prompts
+
 # Main execution
 if __name__ == "__main__":
     print("STEP 1: Generate prompts using Claude")
@@ -172,7 +260,7 @@ if __name__ == "__main__":
     prompts = generate_fitness_prompts(num_prompts=100, batch_size=20)
     
     # Save raw generated prompts
-    save_prompts(prompts, 'fitness_prompts_raw.json')
+    save_prompts(prompts, 'fitness_prompts_raw.jsonl')
     
     # Display all prompts for quick review
     print("\n" + "="*80)
@@ -183,11 +271,17 @@ if __name__ == "__main__":
     
     # Optional: Manual review and filtering
     print("\n" + "="*80)
-    do_review = input("\nDo you want to manually review and filter prompts? (y/n): ")
+    do_review = input("\nDo you want to manually review and filter prompts? (y/n/csv): ").lower().strip()
     
-    if do_review.lower() == 'y':
+    if do_review == 'csv':
+        review_file = export_prompts_for_review(prompts)
+        input(f"\nEdit {review_file}, then press Enter to load it back...")
+        filtered_prompts = load_reviewed_prompts(review_file)
+        save_prompts(filtered_prompts, 'fitness_prompts_filtered.jsonl')
+        final_prompts = filtered_prompts
+    elif do_review == 'y':
         filtered_prompts = review_and_filter_prompts(prompts)
-        save_prompts(filtered_prompts, 'fitness_prompts_filtered.json')
+        save_prompts(filtered_prompts, 'fitness_prompts_filtered.jsonl')
         final_prompts = filtered_prompts
     else:
         final_prompts = prompts
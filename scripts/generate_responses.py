@@ -1,39 +1,39 @@
 # generate_responses.py
 import anthropic
-import json
+import asyncio
+import hashlib
+from itertools import islice
+import orjson
+import shelve
+import sys
 import time
-from datetime import datetime
+from datetime import datetime, timezone
 import os
 
 
-# Initialize the Anthropic client
-client = anthropic.Anthropic(
-     api_key=os.environ.get("ANTHROPIC_API_KEY")
-)
-
-def load_prompts(filename='fitness_prompts_filtered.json'):
-    """Load prompts from JSON file"""
-    with open(filename, 'r') as f:
-        prompts = json.load(f)
-    print(f"Loaded {len(prompts)} prompts from {filename}")
-    return prompts
-
-def generate_response_pair(prompt, temp_a=0.7, temp_b=1.0, model="claude-sonnet-4-20250514"):
+def make_client():
     """
-    Generate two different responses to the same prompt using different temperatures
+    Create the Anthropic client for one generation run
     
-    Args:
-        prompt: The fitness question
-        temp_a: Temperature for first response (lower = more focused)
-        temp_b: Temperature for second response (higher = more creative)
-        model: Which Claude model to use
-    
-    Returns:
-        dict with prompt and two responses
+    Rate limits (429), overloaded/5xx responses and connection errors are
+    retried by the SDK with exponential backoff and jitter, honoring the
+    Retry-After header, so a transient blip no longer loses the prompt.
+    Requests are multiplexed over pooled HTTP/2 connections, so concurrent
+    calls (including both halves of a pair) share a TLS handshake.
+    DefaultAsyncHttpxClient keeps the SDK's own pool limits and keepalive.
     """
-    
-    # System prompt to guide Claude's fitness responses
-    system_prompt = """You are a knowledgeable fitness assistant. Provide helpful, 
+    http_client = anthropic.DefaultAsyncHttpxClient(
+        http2=True,
+        timeout=anthropic.Timeout(60.0, connect=5.0)
+    )
+    return anthropic.AsyncAnthropic(
+        api_key=os.environ.get("ANTHROPIC_API_KEY"),
+        max_retries=6,
+        http_client=http_client
+    )
+
+# System prompt to guide Claude's fitness responses
+SYSTEM_PROMPT = """You are a knowledgeable fitness assistant. Provide helpful, 
 accurate, and safe fitness advice. When answering:
 
 - Be specific and actionable
@@ -45,133 +45,274 @@ accurate, and safe fitness advice. When answering:
 
 Your responses should be informative but concise (2-4 paragraphs typically)."""
 
-    responses = {}
+# On-disk cache of responses, so duplicate prompts and re-runs after a
+# crash don't pay for the same API call twice
+RESPONSE_CACHE_FILE = '.response_cache'
+
+# When fewer requests than this are left in the current rate limit window,
+# wait for the window to reset instead of firing more calls into a 429
+RATE_LIMIT_SAFETY_MARGIN = 5
+
+# Separator lines for the preview output
+SEPARATOR = "=" * 80
+DIVIDER = "─" * 80
+SHORT_DIVIDER = "─" * 40
+
+def iter_prompts(filename='fitness_prompts_filtered.jsonl'):
+    """
+    Read prompts one at a time from a prompts file
     
-    # Generate Response A (lower temperature - more focused/conservative)
+    .jsonl files hold {"prompt": ...} objects as written by generate_prompts.py;
+    any other file is read as one plain-text prompt per line.
+    """
+    is_jsonl = filename.endswith('.jsonl')
+    with open(filename, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield orjson.loads(line)['prompt'] if is_jsonl else line.decode()
+
+def unique_prompts(prompts):
+    """Drop repeated prompts as they stream past (order is kept)"""
+    seen = set()
+    for prompt in prompts:
+        if prompt in seen:
+            print(f"Skipping duplicate prompt: {prompt[:60]}...")
+            continue
+        seen.add(prompt)
+        yield prompt
+
+def written_prompts(output_file):
+    """
+    Prompts that already have a pair in output_file, so a rerun can skip them
+    
+    A last line cut off by a crash is dropped so new pairs append cleanly.
+    """
+    if not os.path.exists(output_file):
+        return set()
+    with open(output_file, 'rb+') as f:
+        lines = f.read().split(b'\n')
+        if lines[-1]:
+            f.truncate(f.tell() - len(lines[-1]))
+    return {orjson.loads(line)['prompt'] for line in lines[:-1] if line.strip()}
+
+def response_cache_key(prompt, temperature, model, side, system_prompt=SYSTEM_PROMPT):
+    """
+    Key identifying one exact request to the API
+    
+    side ('a' or 'b') is part of the key so the two halves of a pair never
+    share a cached response, even when both use the same temperature
+    """
+    return hashlib.sha256(f"{side}|{model}|{temperature}|{system_prompt}|{prompt}".encode()).hexdigest()
+
+async def wait_for_rate_limit(headers, safety_margin=RATE_LIMIT_SAFETY_MARGIN):
+    """
+    Pause only when the API says we're about to hit the request limit
+    
+    Args:
+        headers: Response headers from the last API call
+        safety_margin: Minimum remaining requests before we wait
+    """
+    remaining = headers.get('anthropic-ratelimit-requests-remaining')
+    reset = headers.get('anthropic-ratelimit-requests-reset')
     try:
-        print(f"  Generating response A (temp={temp_a})...")
-        message_a = client.messages.create(
-            model=model,
-            max_tokens=1000,
-            temperature=temp_a,
-            system=system_prompt,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
-        responses['response_a'] = message_a.content[0].text
-        
-        # Small delay between calls
-        time.sleep(0.5)
-        
-    except Exception as e:
-        print(f"  Error generating response A: {e}")
+        if int(remaining) >= safety_margin:
+            return
+        # The reset time is an RFC 3339 timestamp
+        reset_at = datetime.fromisoformat(reset.replace('Z', '+00:00'))
+        wait_seconds = (reset_at - datetime.now(timezone.utc)).total_seconds()
+    except (ValueError, TypeError, AttributeError):
+        # Missing or malformed headers - don't wait, the SDK still retries 429s
+        return
+    
+    if wait_seconds > 0:
+        print(f"  Only {remaining} requests left, waiting {wait_seconds:.1f}s for the rate limit to reset")
+        await asyncio.sleep(wait_seconds)
+
+async def create_response(client, prompt, temperature, model, side, cache=None):
+    """Get one response, from the cache if this exact request was made before"""
+    key = response_cache_key(prompt, temperature, model, side)
+    if cache is not None and key in cache:
+        return cache[key]
+    
+    raw_response = await client.messages.with_raw_response.create(
+        model=model,
+        max_tokens=1000,
+        temperature=temperature,
+        system=SYSTEM_PROMPT,
+        messages=[
+            {"role": "user", "content": prompt}
+        ]
+    )
+    text = raw_response.parse().content[0].text
+    
+    # Cache before pacing, so a response we've paid for is never lost
+    if cache is not None:
+        cache[key] = text
+    
+    await wait_for_rate_limit(raw_response.headers)
+    return text
+
+async def generate_response_pair(client, prompt, temp_a=0.7, temp_b=1.0, model="claude-sonnet-4-20250514",
+                                 cache=None):
+    """
+    Generate two different responses to the same prompt using different temperatures
+    
+    Args:
+        client: AsyncAnthropic client (see make_client)
+        prompt: The fitness question
+        temp_a: Temperature for first response (lower = more focused)
+        temp_b: Temperature for second response (higher = more creative)
+        model: Which Claude model to use
+        cache: Optional dict-like response cache (see RESPONSE_CACHE_FILE)
+    
+    Returns:
+        dict with prompt and two responses
+    """
+    # Request both responses at once, so a pair takes as long as the slower
+    # call rather than the sum of the two
+    # A: lower temperature - more focused/conservative
+    # B: higher temperature - more varied/creative
+    response_a, response_b = await asyncio.gather(
+        create_response(client, prompt, temp_a, model, 'a', cache),
+        create_response(client, prompt, temp_b, model, 'b', cache),
+        return_exceptions=True
+    )
+    
+    if isinstance(response_a, Exception):
+        print(f"  Error generating response A: {response_a}")
+        return None
+    if isinstance(response_b, Exception):
+        print(f"  Error generating response B: {response_b}")
         return None
     
-    # Generate Response B (higher temperature - more varied/creative)
+    return {'response_a': response_a, 'response_b': response_b}
+
+async def generate_all_response_pairs_async(prompts, output_fh, temp_a, temp_b, max_concurrent, cache):
+    """
+    Generate response pairs concurrently, at most max_concurrent prompts in flight
+    
+    prompts can be any iterable; the next prompt is only pulled from it when
+    a slot frees up, so a large file starts generating right away. Each pair
+    is appended to output_fh as one JSON line as soon as it's done, so the
+    file is always an up-to-date checkpoint. Pairs are written in the order
+    they finish; each keeps its prompt_index.
+    """
+    # The client's connection pool belongs to this event loop, so each run
+    # gets its own and closes it when done
+    client = make_client()
+    
+    async def generate_one(prompt_index, prompt):
+        responses = await generate_response_pair(client, prompt, temp_a=temp_a, temp_b=temp_b, cache=cache)
+        return prompt_index, prompt, responses
+    
+    prompt_iter = enumerate(prompts)
+    
+    def start_next(count):
+        """Start tasks for up to count more prompts"""
+        for prompt_index, prompt in islice(prompt_iter, count):
+            pending.add(asyncio.create_task(generate_one(prompt_index, prompt)))
+    
+    pending = set()
+    response_pairs = []
+    failed_prompts = []
+    completed = 0
+    
     try:
-        print(f"  Generating response B (temp={temp_b})...")
-        message_b = client.messages.create(
-            model=model,
-            max_tokens=1000,
-            temperature=temp_b,
-            system=system_prompt,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
-        responses['response_b'] = message_b.content[0].text
-        
-    except Exception as e:
-        print(f"  Error generating response B: {e}")
-        return None
+        start_next(max_concurrent)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            start_next(len(done))
+            
+            for task in done:
+                prompt_index, prompt, responses = task.result()
+                completed += 1
+                print(f"\n[{completed}] Finished: {prompt[:60]}...")
+                
+                if responses is None:
+                    print(f"  ⚠️  Failed to generate responses")
+                    failed_prompts.append(prompt)
+                    continue
+                
+                # Create the data structure
+                pair = {
+                    'prompt': prompt,
+                    'response_a': responses['response_a'],
+                    'response_b': responses['response_b'],
+                    'chosen': None,  # To be labeled later
+                    'metadata': {
+                        'temp_a': temp_a,
+                        'temp_b': temp_b,
+                        'model': 'claude-sonnet-4-20250514',
+                        'generated_at': datetime.now().isoformat(),
+                        'prompt_index': prompt_index
+                    }
+                }
+                
+                response_pairs.append(pair)
+                output_fh.write(orjson.dumps(pair, option=orjson.OPT_APPEND_NEWLINE))
+                output_fh.flush()
+                print(f"  ✓ Generated pair successfully")
+    finally:
+        # Don't leave requests running if we stopped early
+        for task in pending:
+            task.cancel()
+        await client.close()
     
-    return responses
+    # Put the pairs back in prompt order
+    response_pairs.sort(key=lambda pair: pair['metadata']['prompt_index'])
+    return response_pairs, failed_prompts
 
-def generate_all_response_pairs(prompts, output_file='fitness_response_pairs.json',
+def generate_all_response_pairs(prompts, output_file='fitness_response_pairs.jsonl',
                                 temp_a=0.7, temp_b=1.0, max_prompts=None,
-                                checkpoint_frequency=10):
+                                max_concurrent=10):
     """
-    Generate response pairs for all prompts with checkpointing
+    Generate response pairs for all prompts, streaming them to a JSONL file
     
     Args:
-        prompts: List of prompt strings
-        output_file: Where to save the results
+        prompts: Iterable of prompt strings (e.g. from iter_prompts)
+        output_file: Where to save the results (one JSON pair per line)
         temp_a: Temperature for first response
         temp_b: Temperature for second response
         max_prompts: Only process this many prompts (None = all)
-        checkpoint_frequency: Save progress every N prompts
+        max_concurrent: How many prompts to generate responses for at once
     """
     
-    # Limit number of prompts if specified
+    # Drop duplicates and prompts an earlier run already wrote a pair for,
+    # then limit number of prompts if specified
+    done = written_prompts(output_file)
+    prompts = (prompt for prompt in unique_prompts(prompts) if prompt not in done)
     if max_prompts:
-        prompts = prompts[:max_prompts]
-    
-    response_pairs = []
-    failed_prompts = []
+        prompts = islice(prompts, max_prompts)
     
     print(f"\n{'='*80}")
     print(f"GENERATING RESPONSE PAIRS")
     print(f"{'='*80}")
-    print(f"Total prompts to process: {len(prompts)}")
+    print(f"Prompts to process: {max_prompts or 'all'}")
     print(f"Temperature A: {temp_a} (more focused)")
     print(f"Temperature B: {temp_b} (more creative)")
-    print(f"Checkpoint frequency: every {checkpoint_frequency} prompts\n")
+    print(f"Concurrent prompts: {max_concurrent}")
+    print(f"Already in output: {len(done)} (skipped)")
+    print(f"Streaming pairs to: {output_file}\n")
     
     start_time = time.time()
     
-    for i, prompt in enumerate(prompts, 1):
-        print(f"\n[{i}/{len(prompts)}] Processing: {prompt[:60]}...")
-        
-        # Generate the response pair
-        responses = generate_response_pair(prompt, temp_a=temp_a, temp_b=temp_b)
-        
-        if responses is None:
-            print(f"  ⚠️  Failed to generate responses")
-            failed_prompts.append(prompt)
-            continue
-        
-        # Create the data structure
-        pair = {
-            'prompt': prompt,
-            'response_a': responses['response_a'],
-            'response_b': responses['response_b'],
-            'chosen': None,  # To be labeled later
-            'metadata': {
-                'temp_a': temp_a,
-                'temp_b': temp_b,
-                'model': 'claude-sonnet-4-20250514',
-                'generated_at': datetime.now().isoformat(),
-                'prompt_index': i - 1
-            }
-        }
-        
-        response_pairs.append(pair)
-        print(f"  ✓ Generated pair successfully")
-        
-        # Checkpoint: save progress periodically
-        if i % checkpoint_frequency == 0:
-            checkpoint_file = output_file.replace('.json', f'_checkpoint_{i}.json')
-            with open(checkpoint_file, 'w') as f:
-                json.dump(response_pairs, f, indent=2)
-            print(f"\n  💾 Checkpoint saved: {checkpoint_file}")
-        
-        # Rate limiting: pause between prompts to avoid hitting rate limits
-        time.sleep(1)
-    
-    # Save final results
-    with open(output_file, 'w') as f:
-        json.dump(response_pairs, f, indent=2)
+    # Append, so pairs from earlier runs are kept
+    with open(output_file, 'ab') as output_fh, shelve.open(RESPONSE_CACHE_FILE) as cache:
+        response_pairs, failed_prompts = asyncio.run(generate_all_response_pairs_async(
+            prompts, output_fh, temp_a, temp_b, max_concurrent, cache
+        ))
     
     # Calculate statistics
     elapsed_time = time.time() - start_time
-    success_rate = len(response_pairs) / len(prompts) * 100
+    num_processed = len(response_pairs) + len(failed_prompts)
+    success_rate = len(response_pairs) / num_processed * 100 if num_processed else 0.0
     
     print(f"\n{'='*80}")
     print(f"GENERATION COMPLETE")
     print(f"{'='*80}")
     print(f"Total time: {elapsed_time/60:.1f} minutes")
-    print(f"Successful pairs: {len(response_pairs)}/{len(prompts)} ({success_rate:.1f}%)")
+    print(f"Successful pairs: {len(response_pairs)}/{num_processed} ({success_rate:.1f}%)")
     print(f"Failed prompts: {len(failed_prompts)}")
     print(f"Output saved to: {output_file}")
     
@@ -182,35 +323,36 @@ def generate_all_response_pairs(prompts, output_file='fitness_response_pairs.jso
     
     return response_pairs, failed_prompts
 
+def truncate(text, limit=300):
+    """Shorten text for previews"""
+    return text[:limit] + "..." if len(text) > limit else text
+
 def preview_pairs(pairs, num_to_show=3):
     """Preview some generated pairs"""
-    print(f"\n{'='*80}")
-    print(f"PREVIEW OF GENERATED PAIRS")
-    print(f"{'='*80}")
-    
+    # Build the whole preview and write it once instead of print()ing per line
+    buf = f"\n{SEPARATOR}\nPREVIEW OF GENERATED PAIRS\n{SEPARATOR}\n"
     for i, pair in enumerate(pairs[:num_to_show], 1):
-        print(f"\n{'─'*80}")
-        print(f"PAIR {i}")
-        print(f"{'─'*80}")
-        print(f"\nPROMPT:\n{pair['prompt']}")
-        print(f"\n{'─'*40}")
-        print(f"RESPONSE A (temp={pair['metadata']['temp_a']}):")
-        print(pair['response_a'][:300] + "..." if len(pair['response_a']) > 300 else pair['response_a'])
-        print(f"\n{'─'*40}")
-        print(f"RESPONSE B (temp={pair['metadata']['temp_b']}):")
-        print(pair['response_b'][:300] + "..." if len(pair['response_b']) > 300 else pair['response_b'])
+        buf += (
+            f"\n{DIVIDER}\nPAIR {i}\n{DIVIDER}\n"
+            f"\nPROMPT:\n{pair['prompt']}\n"
+            f"\n{SHORT_DIVIDER}\nRESPONSE A (temp={pair['metadata']['temp_a']}):\n"
+            f"{truncate(pair['response_a'])}\n"
+            f"\n{SHORT_DIVIDER}\nRESPONSE B (temp={pair['metadata']['temp_b']}):\n"
+            f"{truncate(pair['response_b'])}\n"
+        )
+    sys.stdout.write(buf)
 
 # Main execution
 if __name__ == "__main__":
     print("STEP 2: Generate response pairs using Claude")
     print("="*80)
     
-    # Load prompts
-    prompts = load_prompts('fitness_prompts_filtered.json')
+    # Prompts are read from the file as they're needed
+    prompts = iter_prompts('fitness_prompts_filtered.jsonl')
     
     # Ask user for configuration
     print("\nConfiguration options:")
-    max_prompts_input = input(f"How many prompts to process? (Enter for all {len(prompts)}): ").strip()
+    max_prompts_input = input("How many prompts to process? (Enter for all): ").strip()
     max_prompts = int(max_prompts_input) if max_prompts_input else None
     
     temp_a_input = input("Temperature for Response A? (default 0.7): ").strip()
@@ -222,11 +364,10 @@ if __name__ == "__main__":
     # Generate response pairs
     pairs, failed = generate_all_response_pairs(
         prompts,
-        output_file='fitness_response_pairs.json',
+        output_file='fitness_response_pairs.jsonl',
         temp_a=temp_a,
         temp_b=temp_b,
-        max_prompts=max_prompts,
-        checkpoint_frequency=10
+        max_prompts=max_prompts
     )
     
     # Preview some results
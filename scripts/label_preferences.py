@@ -1,41 +1,123 @@
 # label_preferences.py
-import json
+import orjson
+from collections import Counter
 from datetime import datetime
 import os
+import random
+import sys
+import time
+from prompt_toolkit import Application
+from prompt_toolkit.key_binding import KeyBindings
+from prompt_toolkit.layout import FormattedTextControl, Layout, Window
+from label_records import iter_jsonl, join_labels, load_jsonl, pair_hash, prompt_hash
+
+# Separator lines for the labeling screen
+SEPARATOR = "=" * 80
+DIVIDER = "─" * 80
+
+# Single-key choices when labeling in a terminal
+PREFERENCE_KEYS = {'a': 'a', 'b': 'b', 'e': 'equal', 's': 'skip', 'q': 'q'}
+
+def reservoir_sample(items, k, rng=random):
+    """
+    Pick k items uniformly at random in one pass, holding only k in memory
+    
+    Args:
+        items: Any iterable, e.g. iter_jsonl(...)
+        k: How many to pick (fewer if items runs out first)
+        rng: Source of randomness (random.Random instance or the random module)
+    """
+    sample = []
+    for i, item in enumerate(items):
+        if i < k:
+            sample.append(item)
+        else:
+            j = rng.randint(0, i)
+            if j < k:
+                sample[j] = item
+    return sample
+
+def read_key(keys):
+    """
+    Wait for a single keypress and return what it maps to
+    
+    Args:
+        keys: dict of key -> value to return; other keys are ignored
+    """
+    bindings = KeyBindings()
+    for key, value in keys.items():
+        bindings.add(key)(lambda event, value=value: event.app.exit(result=value))
+    # Ctrl-C quits (and saves) rather than killing the session
+    bindings.add('c-c')(lambda event: event.app.exit(result='q'))
+    
+    app = Application(layout=Layout(Window(FormattedTextControl(''), height=1)),
+                      key_bindings=bindings, full_screen=False, erase_when_done=True)
+    return app.run()
 
 class PreferenceLabelingTool:
     def __init__(self, data_file):
-        with open(data_file, 'r') as f:
-            self.data = json.load(f)
+        self.data = load_jsonl(data_file)
         self.current_idx = 0
-        self.labeled_data = []
         self.session_start = datetime.now()
         
+        # Labels are appended to the progress file; _unsaved_labels holds
+        # the ones that aren't on disk yet
+        self.progress_file = data_file.replace('.jsonl', '_labeled.jsonl')
+        self._unsaved_labels = []
+        self._append_progress = False
+        
+        # Hashes of every labeled prompt, one per line, appended alongside the
+        # progress file so resuming doesn't have to parse all the labels
+        self.index_file = data_file.replace('.jsonl', '.labeled_index')
+        self._labeled_hashes = set()
+        
         # Load existing progress if available
-        self.progress_file = data_file.replace('.json', '_labeled.json')
         if os.path.exists(self.progress_file):
             load_progress = input(f"\nFound existing progress file. Load it? (y/n): ")
             if load_progress.lower() == 'y':
-                with open(self.progress_file, 'r') as f:
-                    self.labeled_data = json.load(f)
-                print(f"Loaded {len(self.labeled_data)} previously labeled examples")
+                if os.path.exists(self.index_file):
+                    with open(self.index_file) as f:
+                        self._labeled_hashes = {line.strip() for line in f if line.strip()}
+                else:
+                    # Progress from before the index existed - build it once
+                    self._labeled_hashes = {item.get('prompt_hash') or prompt_hash(item['prompt'])
+                                            for item in iter_jsonl(self.progress_file)}
+                    with open(self.index_file, 'w') as f:
+                        f.writelines(h + '\n' for h in self._labeled_hashes)
+                self._append_progress = True
+                print(f"Loaded {len(self._labeled_hashes)} previously labeled examples")
         
-    def display_pair(self, idx):
+    def render_pair(self, idx):
+        """Build the full screen for one example as a single string"""
         item = self.data[idx]
-        print("\n" + "="*80)
-        print(f"Example {idx + 1} / {len(self.data)}")
-        print("="*80)
-        print(f"\nPROMPT:\n{item['prompt']}")
-        print(f"\n{'─'*80}")
-        print(f"\nRESPONSE A (temp={item['metadata']['temp_a']}):")
-        print(item['response_a'])
-        print(f"\n{'─'*80}")
-        print(f"\nRESPONSE B (temp={item['metadata']['temp_b']}):")
-        print(item['response_b'])
-        print(f"\n{'─'*80}")
+        return (
+            f"\n{SEPARATOR}\n"
+            f"Example {idx + 1} / {len(self.data)}\n"
+            f"{SEPARATOR}\n"
+            f"\nPROMPT:\n{item['prompt']}\n"
+            f"\n{DIVIDER}\n"
+            f"\nRESPONSE A (temp={item['metadata']['temp_a']}):\n"
+            f"{item['response_a']}\n"
+            f"\n{DIVIDER}\n"
+            f"\nRESPONSE B (temp={item['metadata']['temp_b']}):\n"
+            f"{item['response_b']}\n"
+            f"\n{DIVIDER}\n"
+        )
+    
+    def display_pair(self, idx, screen=None):
+        # One write per screen instead of a print() per line
+        sys.stdout.write(screen if screen is not None else self.render_pair(idx))
         
     def get_preference(self):
         """Get user's preference with validation"""
+        # In a terminal a single keypress is enough, no Enter needed
+        if sys.stdin.isatty():
+            sys.stdout.write("\nWhich is better? (a/b/e=equal/s=skip/q=quit): ")
+            sys.stdout.flush()
+            choice = read_key(PREFERENCE_KEYS)
+            print(choice)
+            return choice
+        
         while True:
             choice = input("\nWhich is better? (a/b/equal/skip/quit): ").lower().strip()
             if choice in ['a', 'b', 'equal', 'skip', 'q', 'quit']:
@@ -74,9 +156,6 @@ class PreferenceLabelingTool:
             num_examples: How many to label (None = all remaining)
             auto_save_frequency: Save progress every N examples
         """
-        # Skip already labeled examples
-        already_labeled_prompts = {item['prompt'] for item in self.labeled_data}
-        
         self.current_idx = start_idx
         end_idx = len(self.data) if num_examples is None else start_idx + num_examples
         
@@ -97,20 +176,27 @@ When comparing responses, consider:
 
 Choose 'a' if Response A is better
 Choose 'b' if Response B is better
-Choose 'equal' if both are roughly the same quality
-Choose 'skip' if you're unsure or need to revisit
-Choose 'quit' to stop and save progress
+Choose 'equal' ('e') if both are roughly the same quality
+Choose 'skip' ('s') if you're unsure or need to revisit
+Choose 'quit' ('q') to stop and save progress
+In a terminal, a single keypress picks - no need to press Enter
 """)
         
         input("Press Enter to start labeling...")
         
-        for idx in range(start_idx, min(end_idx, len(self.data))):
+        last_idx = min(end_idx, len(self.data))
+        next_screen = None
+        for idx in range(start_idx, last_idx):
             # Skip if already labeled
-            if self.data[idx]['prompt'] in already_labeled_prompts:
+            if prompt_hash(self.data[idx]['prompt']) in self._labeled_hashes:
                 print(f"\nSkipping example {idx + 1} (already labeled)")
+                next_screen = None
                 continue
             
-            self.display_pair(idx)
+            self.display_pair(idx, next_screen)
+            # Render the following example before waiting on the keypress,
+            # so it shows up immediately after this one is labeled
+            next_screen = self.render_pair(idx + 1) if idx + 1 < last_idx else None
             preference = self.get_preference()
             
             if preference in ['q', 'quit']:
@@ -128,29 +214,22 @@ Choose 'quit' to stop and save progress
             # Optional: Get detailed ratings
             # ratings = self.get_quality_ratings()
             
-            # Record the label
-            item = self.data[idx].copy()
-            
-            if preference == 'a':
-                item['chosen'] = item['response_a']
-                item['rejected'] = item['response_b']
-                item['preference'] = 'a'
-            elif preference == 'b':
-                item['chosen'] = item['response_b']
-                item['rejected'] = item['response_a']
-                item['preference'] = 'b'
-            else:  # equal
-                item['chosen'] = item['response_a']
-                item['rejected'] = item['response_b']
-                item['equal'] = True
-                item['preference'] = 'equal'
+            # Record the label - just the decision, the pair itself stays in
+            # data_file and is joined back in by join_labels. Pairs are found
+            # by prompt (line order changes between generation runs), and
+            # pair_hash catches responses that were regenerated since
+            label = {
+                'prompt_hash': prompt_hash(self.data[idx]['prompt']),
+                'pair_hash': pair_hash(self.data[idx]),
+                'preference': preference,
+                'reasoning': reasoning,
+                # 'quality_ratings': ratings,  # Uncomment if using ratings
+                'labeled_at': time.time(),  # Converted to ISO format on save
+                'labeler': 'primary'  # Useful if you have multiple labelers
+            }
             
-            item['reasoning'] = reasoning
-            # item['quality_ratings'] = ratings  # Uncomment if using ratings
-            item['labeled_at'] = datetime.now().isoformat()
-            item['labeler'] = 'primary'  # Useful if you have multiple labelers
-            
-            self.labeled_data.append(item)
+            self._labeled_hashes.add(label['prompt_hash'])
+            self._unsaved_labels.append(label)
             labeled_this_session += 1
             
             print(f"  ✓ Labeled as: {preference}")
@@ -158,7 +237,7 @@ Choose 'quit' to stop and save progress
             # Auto-save progress
             if labeled_this_session % auto_save_frequency == 0:
                 self.save_progress()
-                print(f"\n  💾 Auto-saved! ({len(self.labeled_data)} total labeled)")
+                print(f"\n  💾 Auto-saved! ({len(self._labeled_hashes)} total labeled)")
         
         # Final save
         self.save_progress()
@@ -171,38 +250,49 @@ Choose 'quit' to stop and save progress
         print(f"{'='*80}")
         print(f"Labeled this session: {labeled_this_session}")
         print(f"Skipped: {skipped_count}")
-        print(f"Total labeled so far: {len(self.labeled_data)}")
-        print(f"Remaining: {len(self.data) - len(self.labeled_data)}")
+        print(f"Total labeled so far: {len(self._labeled_hashes)}")
+        print(f"Remaining: {len(self.data) - len(self._labeled_hashes)}")
         print(f"Session duration: {session_duration:.1f} minutes")
         if labeled_this_session > 0:
             print(f"Average time per label: {session_duration/labeled_this_session:.1f} minutes")
         print(f"\nProgress saved to: {self.progress_file}")
     
     def save_progress(self):
-        """Save current progress"""
-        with open(self.progress_file, 'w') as f:
-            json.dump(self.labeled_data, f, indent=2)
+        """Append labels made since the last save to the progress file and index"""
+        # Start fresh files unless we're continuing loaded progress
+        mode = 'a' if self._append_progress else 'w'
+        with open(self.progress_file, mode + 'b') as f:
+            for label in self._unsaved_labels:
+                label = {**label, 'labeled_at': datetime.fromtimestamp(label['labeled_at']).isoformat()}
+                f.write(orjson.dumps(label, option=orjson.OPT_APPEND_NEWLINE))
+        with open(self.index_file, mode) as f:
+            f.writelines(label['prompt_hash'] + '\n' for label in self._unsaved_labels)
+        self._unsaved_labels = []
+        self._append_progress = True
     
     def show_statistics(self):
         """Display labeling statistics"""
-        if not self.labeled_data:
+        if not self._labeled_hashes:
             print("No labeled data yet!")
             return
         
-        preferences = [item.get('preference', 'unknown') for item in self.labeled_data]
+        # Labels are only kept on disk, and every session ends with a save.
+        # Count all preferences in one pass over the file
+        preference_counts = Counter(label.get('preference', 'unknown')
+                                    for label in iter_jsonl(self.progress_file))
+        a_count = preference_counts['a']
+        b_count = preference_counts['b']
         
         print(f"\n{'='*80}")
         print(f"LABELING STATISTICS")
         print(f"{'='*80}")
-        print(f"Total labeled: {len(self.labeled_data)}")
+        print(f"Total labeled: {sum(preference_counts.values())}")
         print(f"\nPreference breakdown:")
-        print(f"  Response A preferred: {preferences.count('a')}")
-        print(f"  Response B preferred: {preferences.count('b')}")
-        print(f"  Equal quality: {preferences.count('equal')}")
+        print(f"  Response A preferred: {a_count}")
+        print(f"  Response B preferred: {b_count}")
+        print(f"  Equal quality: {preference_counts['equal']}")
         
         # Show which temperature was preferred more
-        a_count = preferences.count('a')
-        b_count = preferences.count('b')
         if a_count + b_count > 0:
             temp_a = self.data[0]['metadata']['temp_a']
             temp_b = self.data[0]['metadata']['temp_b']
@@ -210,18 +300,32 @@ Choose 'quit' to stop and save progress
             print(f"  Temp {temp_a} (Response A) won: {a_count} times ({a_count/(a_count+b_count)*100:.1f}%)")
             print(f"  Temp {temp_b} (Response B) won: {b_count} times ({b_count/(a_count+b_count)*100:.1f}%)")
 
-def review_labeled_samples(labeled_file, num_samples=5):
-    """Review some random labeled examples"""
-    import random
+def review_labeled_samples(labeled_file, data, num_samples=5, seed=None):
+    """
+    Review some random labeled examples
     
-    with open(labeled_file, 'r') as f:
-        labeled = json.load(f)
+    Args:
+        labeled_file: Progress file from the labeling tool
+        data: The response pairs the labels were made against
+        num_samples: How many examples to show
+        seed: Fix this to see the same examples again
+    """
+    # Stream the labels rather than loading the whole file to show a handful
+    rng = random.Random(seed)
+    samples = reservoir_sample(iter_jsonl(labeled_file), num_samples, rng)
     
-    if len(labeled) == 0:
+    if len(samples) == 0:
         print("No labeled examples yet!")
         return
     
-    samples = random.sample(labeled, min(num_samples, len(labeled)))
+    # Reservoir order isn't random for the first picks, so shuffle for display
+    rng.shuffle(samples)
+    try:
+        samples = join_labels(samples, data)
+    except ValueError as e:
+        # Stale labels shouldn't take the menu down; just report them
+        print(f"\nCan't review samples: {e}")
+        return
     
     print(f"\n{'='*80}")
     print(f"REVIEWING {len(samples)} RANDOM LABELED EXAMPLES")
@@ -243,7 +347,7 @@ if __name__ == "__main__":
     print("="*80)
     
     # Load the response pairs
-    data_file = 'fitness_response_pairs.json'
+    data_file = 'fitness_response_pairs.jsonl'
     
     if not os.path.exists(data_file):
         print(f"Error: {data_file} not found!")
@@ -270,7 +374,7 @@ if __name__ == "__main__":
             num_to_label = int(num_input) if num_input else None
             
             labeler.label_session(
-                start_idx=len(labeler.labeled_data),
+                start_idx=len(labeler._labeled_hashes),
                 num_examples=num_to_label,
                 auto_save_frequency=5
             )
@@ -280,7 +384,7 @@ if __name__ == "__main__":
         
         elif choice == '3':
             if os.path.exists(labeler.progress_file):
-                review_labeled_samples(labeler.progress_file, num_samples=5)
+                review_labeled_samples(labeler.progress_file, labeler.data, num_samples=5)
             else:
                 print("No labeled data yet!")
         
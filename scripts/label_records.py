@@ -0,0 +1,63 @@
+# label_records.py
+# Reading labeling progress files and joining labels back onto their pairs,
+# shared by label_preferences.py and format_dataset.py
+import hashlib
+import orjson
+
+def iter_jsonl(filename):
+    """Yield the JSON objects in a file one line at a time"""
+    with open(filename, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield orjson.loads(line)
+
+def load_jsonl(filename):
+    """Load a file with one JSON object per line"""
+    return list(iter_jsonl(filename))
+
+def prompt_hash(prompt):
+    """Short stable id for a prompt, used in the labeled index"""
+    return hashlib.sha1(prompt.encode()).hexdigest()
+
+def pair_hash(pair):
+    """Id for the exact responses in a pair, so a label can't follow a regenerated pair"""
+    return hashlib.sha1(f"{pair['prompt']}\0{pair['response_a']}\0{pair['response_b']}".encode()).hexdigest()
+
+def join_labels(labels, pairs):
+    """
+    Join labels back onto their response pairs, filling in chosen/rejected
+    
+    Args:
+        labels: Records from the progress file
+        pairs: The response pairs the labels were made against
+    
+    Raises:
+        ValueError: if a label's pair is missing or its responses changed
+    """
+    pairs_by_hash = {prompt_hash(pair['prompt']): pair for pair in pairs}
+    
+    data = []
+    for label in labels:
+        # Older progress files stored the whole labeled pair
+        if 'prompt' in label:
+            data.append(label)
+            continue
+        
+        pair = pairs_by_hash.get(label.get('prompt_hash'))
+        if pair is None or pair_hash(pair) != label.get('pair_hash'):
+            raise ValueError(
+                f"Label made at {label.get('labeled_at')} doesn't match any pair in the "
+                f"response pairs file - were the pairs regenerated after labeling?"
+            )
+        
+        item = {**pair, **label}
+        if label['preference'] == 'b':
+            item['chosen'] = item['response_b']
+            item['rejected'] = item['response_a']
+        else:  # 'a' or equal
+            item['chosen'] = item['response_a']
+            item['rejected'] = item['response_b']
+        if label['preference'] == 'equal':
+            item['equal'] = True
+        data.append(item)
+    return data
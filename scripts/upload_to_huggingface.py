@@ -1,39 +1,64 @@
 # upload_to_huggingface.py
-from huggingface_hub import HfApi, create_repo, upload_folder
-from datasets import Dataset, DatasetDict, load_dataset
-import json
+from huggingface_hub import HfApi, create_repo
+from datasets import load_dataset
+import math
 import os
+import shutil
+
+# Keep parquet shards small enough that re-uploading one changed shard is cheap
+MAX_SHARD_SIZE = 200 * 1024 * 1024
 
 def load_dataset_from_jsonl(data_dir='fitness_dataset'):
-    """Load the dataset from JSONL files"""
-    
-    def load_jsonl(file_path):
-        data = []
-        with open(file_path, 'r') as f:
-            for line in f:
-                data.append(json.loads(line))
-        return data
-    
-    # Load each split
-    train_data = load_jsonl(os.path.join(data_dir, 'train.jsonl'))
-    val_data = load_jsonl(os.path.join(data_dir, 'validation.jsonl'))
-    test_data = load_jsonl(os.path.join(data_dir, 'test.jsonl'))
-    
-    # Create Dataset objects
-    dataset_dict = DatasetDict({
-        'train': Dataset.from_list(train_data),
-        'validation': Dataset.from_list(val_data),
-        'test': Dataset.from_list(test_data)
-    })
+    """Load the dataset from gzipped JSONL files"""
+    
+    # The json builder parses the files with Arrow's JSON reader and
+    # memory-maps the result, instead of building Python lists first.
+    # Arrow's reader is multithreaded and runs outside the GIL, so one
+    # builder run over all three splits needs no extra parallelism
+    data_files = {
+        'train': os.path.join(data_dir, 'train.jsonl.gz'),
+        'validation': os.path.join(data_dir, 'validation.jsonl.gz'),
+        'test': os.path.join(data_dir, 'test.jsonl.gz')
+    }
+    dataset_dict = load_dataset('json', data_files=data_files)
     
     print(f"\nDataset loaded:")
-    print(f"  Train: {len(train_data)} examples")
-    print(f"  Validation: {len(val_data)} examples")
-    print(f"  Test: {len(test_data)} examples")
-    print(f"  Total: {len(train_data) + len(val_data) + len(test_data)} examples")
+    print(f"  Train: {len(dataset_dict['train'])} examples")
+    print(f"  Validation: {len(dataset_dict['validation'])} examples")
+    print(f"  Test: {len(dataset_dict['test'])} examples")
+    print(f"  Total: {sum(len(split) for split in dataset_dict.values())} examples")
     
     return dataset_dict
 
+def write_hub_folder(dataset_dict, data_dir='fitness_dataset', max_shard_size=MAX_SHARD_SIZE):
+    """
+    Write each split as parquet shards under data_dir/hub/data/, plus the card
+    
+    Args:
+        dataset_dict: DatasetDict with train/val/test splits
+        data_dir: Directory containing README.md
+        max_shard_size: Largest shard in bytes, so a change only dirties one shard
+    """
+    upload_dir = os.path.join(data_dir, 'hub')
+    shard_dir = os.path.join(upload_dir, 'data')
+    # Start clean so shards from an earlier, bigger run don't linger
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    os.makedirs(shard_dir)
+    
+    for split_name, split in dataset_dict.items():
+        num_shards = max(1, math.ceil(split.data.nbytes / max_shard_size))
+        for index in range(num_shards):
+            shard = split.shard(num_shards=num_shards, index=index, contiguous=True)
+            shard.to_parquet(os.path.join(shard_dir, f'{split_name}-{index:05d}-of-{num_shards:05d}.parquet'))
+    
+    readme_path = os.path.join(data_dir, 'README.md')
+    if os.path.exists(readme_path):
+        shutil.copyfile(readme_path, os.path.join(upload_dir, 'README.md'))
+    else:
+        print("  ⚠️  README.md not found, uploading without a dataset card")
+    
+    return upload_dir
+
 def upload_to_hf(dataset_dict, repo_name, data_dir='fitness_dataset'):
     """
     Upload dataset to Hugging Face Hub
@@ -65,26 +90,24 @@ def upload_to_hf(dataset_dict, repo_name, data_dir='fitness_dataset'):
         )
         print("  ✓ Repository created/verified")
         
-        # Step 2: Push dataset
-        print(f"\nStep 2: Pushing dataset to Hub...")
-        dataset_dict.push_to_hub(repo_name)
-        print("  ✓ Dataset files uploaded")
+        # Step 2: Write parquet shards locally, in the same layout push_to_hub uses
+        print(f"\nStep 2: Writing parquet shards...")
+        upload_dir = write_hub_folder(dataset_dict, data_dir)
+        print(f"  ✓ Shards written to {upload_dir}/")
         
-        # Step 3: Upload README.md (dataset card)
-        print(f"\nStep 3: Uploading dataset card (README.md)...")
+        # Step 3: Upload shards and README.md (dataset card) in one commit
+        # Files are content-addressed on the Hub, so shards that haven't
+        # changed since the last upload aren't sent again
+        print(f"\nStep 3: Uploading dataset files and card...")
         api = HfApi()
-        readme_path = os.path.join(data_dir, 'README.md')
-        
-        if os.path.exists(readme_path):
-            api.upload_file(
-                path_or_fileobj=readme_path,
-                path_in_repo="README.md",
-                repo_id=repo_name,
-                repo_type="dataset",
-            )
-            print("  ✓ Dataset card uploaded")
-        else:
-            print("  ⚠️  README.md not found, skipping")
+        api.upload_folder(
+            folder_path=upload_dir,
+            repo_id=repo_name,
+            repo_type="dataset",
+            delete_patterns="data/*",  # Drop old shards that aren't in this upload
+            commit_message="Upload dataset"
+        )
+        print("  ✓ Dataset files uploaded")
         
         print("\n" + "="*80)
         print("UPLOAD COMPLETE!")